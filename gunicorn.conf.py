@@ -0,0 +1,14 @@
+"""
+Gunicorn configuration for production deployments.
+
+Run with: gunicorn -c gunicorn.conf.py main:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count() + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+keepalive = 5
@@ -1,32 +1,93 @@
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, HTTPException, Request
+import uuid
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from pydantic import BaseModel, EmailStr, Field, ValidationError, model_validator
+from typing import List, Optional, Tuple
 from bson import ObjectId
-import requests
+from pymongo import ReturnDocument
+import httpx
+import orjson
+import redis.asyncio as aioredis
 
-from database import db, create_document, get_documents
-from schemas import Escrow, Recipient, TelegramProfile
+from database import db, aggregate_documents, create_document
+from schemas import Chain, Currency, Escrow, Recipient, TelegramProfile
 
-app = FastAPI(title="SplitPay API", version="0.2.0")
+logger = logging.getLogger(__name__)
+
+redis_client: Optional[aioredis.Redis] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client, tg_client
+    try:
+        # Redis is optional; the server should run with maxmemory-policy allkeys-lfu so hot
+        # listings stay cached under memory pressure
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            redis_client = aioredis.from_url(redis_url, decode_responses=False)
+            FastAPICache.init(RedisBackend(redis_client))
+        else:
+            FastAPICache.init(InMemoryBackend())
+
+        if db is not None:
+            # Both branches of the payer/recipient $or lookup need an index, with updated_at so the
+            # newest-first listings are read in index order instead of sorted in memory
+            try:
+                await db["escrow"].create_index([("payer_email", 1), ("updated_at", -1)])
+                await db["escrow"].create_index([("recipients.email", 1), ("updated_at", -1)])
+                await db["telegramprofile"].create_index("chat_id", unique=True)
+            except Exception:
+                # Keep serving; /test reports database trouble
+                logger.exception("Failed to create MongoDB indexes")
+
+        # One pooled keep-alive client for all outbound Telegram calls
+        tg_client = httpx.AsyncClient(timeout=5, limits=httpx.Limits(max_keepalive_connections=10, max_connections=50))
+        yield
+    finally:
+        if tg_client is not None:
+            await tg_client.aclose()
+            tg_client = None
+        if redis_client is not None:
+            await redis_client.aclose()
+            redis_client = None
+
+
+app = FastAPI(title="SplitPay API", version="0.2.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Comma-separated origin whitelist. Without one we fall back to a plain wildcard; credentials
+# are only allowed with explicit origins, since "*" + credentials makes Starlette reflect
+# the Origin header on every response.
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials="*" not in ALLOWED_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
 
 @app.get("/")
-def read_root():
+@cache(expire=3600)
+async def read_root():
     return {"message": "SplitPay backend is running"}
 
 
 @app.get("/test")
-def test_database():
+@cache(expire=10)  # absorbs health-check polling; never cache per-user endpoints
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -43,7 +104,7 @@ def test_database():
                 os.getenv("DATABASE_NAME") if os.getenv("DATABASE_NAME") else "❌ Not Set"
             )
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
                 response["connection_status"] = "Connected"
@@ -60,161 +121,447 @@ class CreateEscrowRequest(BaseModel):
     title: str
     description: Optional[str] = None
     payer_email: EmailStr
-    total_amount: float
-    currency: str = "USDC"
-    chain: str = "testnet"
+    total_amount: float = Field(..., gt=0, allow_inf_nan=False)
+    currency: Currency = "USDC"
+    chain: Chain = "testnet"
     recipients: List[Recipient]
 
+    @model_validator(mode="after")
+    def _check_percentages(self):
+        if abs(sum(r.percentage for r in self.recipients) - 100) > 1e-6:
+            raise ValueError("Recipient percentages must add up to 100")
+        return self
 
-@app.post("/api/escrows")
-def create_escrow(payload: CreateEscrowRequest):
-    # Validate recipient percentages add to 100
-    total_pct = sum(r.percentage for r in payload.recipients)
-    if abs(total_pct - 100) > 1e-6:
-        raise HTTPException(status_code=400, detail="Recipient percentages must add up to 100")
-
-    # Build escrow document using our schema
-    escrow_doc = Escrow(
-        title=payload.title,
-        description=payload.description,
-        payer_email=payload.payer_email,
-        total_amount=payload.total_amount,
-        currency=payload.currency,
-        chain=payload.chain,
-        recipients=payload.recipients,
-        payer_confirmed=False,
-        status="funded",
-    )
 
-    inserted_id = create_document("escrow", escrow_doc)
+@app.post("/api/escrows")
+async def create_escrow(payload: CreateEscrowRequest):
+    # The payload already carries Escrow's constraints, so build the document from it directly
+    # instead of validating everything a second time through Escrow(...)
+    escrow_doc = payload.model_dump()
+    escrow_doc.update({"payer_confirmed": False, "status": "funded"})
+
+    inserted_id = await create_document("escrow", escrow_doc)
+    await _invalidate_escrow_lists(escrow_doc["payer_email"], [r["email"] for r in escrow_doc["recipients"]])
     return {"id": inserted_id, "message": "Escrow created"}
 
 
-@app.get("/api/escrows")
-def list_escrows(email: Optional[str] = None):
-    """List escrows, optionally filtered by an actor's email (payer or recipient)."""
+# Fields consumed by escrow listings (including the Telegram /my view)
+ESCROW_SUMMARY_PROJECTION = {
+    "title": 1,
+    "status": 1,
+    "currency": 1,
+    "total_amount": 1,
+    "payer_email": 1,
+    "recipients.email": 1,
+}
+
+
+ESCROW_LIST_TTL = 30  # seconds
+
+
+# Cached listings are stored under a per-email generation token. Writes replace the token
+# instead of deleting, so a read that queried Mongo before a write can only cache its result
+# under the superseded generation, which is never read again. Tokens are random rather than a
+# counter: if allkeys-lfu evicts a token, the next read mints a fresh one instead of restarting
+# at a value whose listings may still be cached.
+def _escrow_list_namespace(email: Optional[str]) -> str:
+    # The unfiltered listing gets its own prefix so no email value can collide with it
+    return f"escrows:email:{email}" if email else "escrows-all"
+
+
+def _escrow_list_version_key(email: Optional[str]) -> str:
+    return f"{_escrow_list_namespace(email)}:ver"
+
+
+def _escrow_list_key(email: Optional[str], version: str, limit: int) -> str:
+    return f"{_escrow_list_namespace(email)}:v{version}:n{limit}"
+
+
+def _new_escrow_list_version() -> str:
+    return uuid.uuid4().hex
+
+
+async def _invalidate_escrow_lists(payer_email: str, recipient_emails: List[str]):
+    """Expire cached listings for every actor on an escrow after it is written."""
+    if redis_client is None:
+        return
+    emails = {None, payer_email, *recipient_emails}
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for email in emails:
+                pipe.set(_escrow_list_version_key(email), _new_escrow_list_version())
+            await pipe.execute()
+    except aioredis.RedisError:
+        logger.exception("Failed to invalidate escrow listings")
+
+
+async def _escrow_list_version(email: Optional[str]) -> Optional[str]:
+    version_key = _escrow_list_version_key(email)
+    version = await redis_client.get(version_key)
+    if version is None:
+        # First read, or the token was evicted: start a generation no cached listing can share
+        fresh = _new_escrow_list_version()
+        if await redis_client.set(version_key, fresh, nx=True):
+            return fresh
+        version = await redis_client.get(version_key)
+    return version.decode() if version is not None else None
+
+
+async def _list_escrows(email: Optional[str] = None, limit: int = 50) -> List[dict]:
+    """Return the newest escrows for an actor (or all escrows), served from Redis when cached."""
+    key = None
+    if redis_client is not None:
+        try:
+            version = await _escrow_list_version(email)
+            if version is not None:
+                key = _escrow_list_key(email, version, limit)
+                cached = await redis_client.get(key)
+                if cached is not None:
+                    return orjson.loads(cached)
+        except aioredis.RedisError:
+            logger.exception("Failed to read cached escrow listing")
+            key = None
+
     filter_query = {}
     if email:
         filter_query = {"$or": [{"payer_email": email}, {"recipients.email": email}]}
-    escrows = get_documents("escrow", filter_query, limit=50)
-    # Serialize ObjectId
-    for e in escrows:
-        if isinstance(e.get("_id"), ObjectId):
-            e["id"] = str(e["_id"])  # expose as id
-            del e["_id"]
-    return {"items": escrows}
+    # Rename _id to a string id server-side so no ObjectIds are decoded or rewritten in Python
+    escrows = await aggregate_documents(
+        "escrow",
+        [
+            {"$match": filter_query},
+            {"$sort": {"updated_at": -1}},
+            {"$limit": limit},
+            {"$project": {**ESCROW_SUMMARY_PROJECTION, "id": {"$toString": "$_id"}, "_id": 0}},
+        ],
+    )
+
+    if key is not None:
+        try:
+            await redis_client.set(key, orjson.dumps(escrows), ex=ESCROW_LIST_TTL)
+        except aioredis.RedisError:
+            logger.exception("Failed to cache escrow listing")
+    return escrows
+
+
+@app.get("/api/escrows")
+async def list_escrows(email: Optional[str] = None):
+    """List escrows, optionally filtered by an actor's email (payer or recipient)."""
+    return {"items": await _list_escrows(email)}
 
 
 class ConfirmRequest(BaseModel):
     actor: EmailStr
 
 
-@app.post("/api/escrows/{escrow_id}/confirm")
-def confirm_escrow(escrow_id: str, payload: ConfirmRequest):
-    # Minimal logical confirmation: set flags when payer and all recipients confirmed
-    from datetime import datetime, timezone
-
+# ----- Escrow service layer -----
+# Shared by the HTTP endpoints and the Telegram handlers so in-process callers skip
+# request-model validation and response serialization.
+def _parse_escrow_id(escrow_id: str) -> ObjectId:
     try:
-        oid = ObjectId(escrow_id)
+        return ObjectId(escrow_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid escrow id")
 
-    doc = db["escrow"].find_one({"_id": oid})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Escrow not found")
 
-    # Determine if actor is payer or a recipient
-    updates = {"updated_at": datetime.now(timezone.utc)}
-    if payload.actor == doc.get("payer_email"):
-        updates["payer_confirmed"] = True
-    else:
-        # mark recipient confirmed if email matches
-        recs = doc.get("recipients", [])
-        changed = False
-        for r in recs:
-            if r.get("email") == payload.actor:
-                r["confirmed"] = True
-                changed = True
-        if changed:
-            updates["recipients"] = recs
-        else:
+async def _confirm_escrow(oid: ObjectId, actor: str) -> dict:
+    """Record the actor's confirmation and return the updated escrow document."""
+    # Mark the actor confirmed and derive the status server-side in a single atomic update.
+    # actor is wrapped in $literal inside expressions: a "$"-prefixed email would otherwise be
+    # read as a field path or variable.
+    doc = await db["escrow"].find_one_and_update(
+        # Released/cancelled escrows are closed; without the status guard a repeat confirm
+        # would flip them back to releasable and allow a second release
+        {
+            "_id": oid,
+            "status": {"$in": ["funded", "releasable"]},
+            "$or": [{"payer_email": actor}, {"recipients.email": actor}],
+        },
+        [
+            {
+                "$set": {
+                    "payer_confirmed": {"$cond": [{"$eq": ["$payer_email", {"$literal": actor}]}, True, "$payer_confirmed"]},
+                    "recipients": {
+                        "$map": {
+                            "input": "$recipients",
+                            "as": "r",
+                            # Only the actor's element changes; the rest pass through untouched so the
+                            # update's oplog delta is limited to that one recipient
+                            "in": {
+                                "$cond": [
+                                    {"$eq": ["$$r.email", {"$literal": actor}]},
+                                    {"$mergeObjects": ["$$r", {"confirmed": True}]},
+                                    "$$r",
+                                ]
+                            },
+                        }
+                    },
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            },
+            # Releasable once the payer and all recipients have confirmed
+            {
+                "$set": {
+                    "status": {
+                        "$cond": [
+                            {
+                                "$and": [
+                                    "$payer_confirmed",
+                                    {"$allElementsTrue": {"$map": {"input": "$recipients", "in": "$$this.confirmed"}}},
+                                ]
+                            },
+                            "releasable",
+                            "$status",
+                        ]
+                    }
+                }
+            },
+        ],
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        # Only the miss path pays for a second lookup to tell the errors apart
+        existing = await db["escrow"].find_one(
+            {"_id": oid}, {"status": 1, "payer_email": 1, "recipients.email": 1}
+        )
+        if not existing:
+            raise HTTPException(status_code=404, detail="Escrow not found")
+        actors = {existing.get("payer_email")} | {r.get("email") for r in existing.get("recipients", [])}
+        if actor not in actors:
             raise HTTPException(status_code=400, detail="Actor not part of this escrow")
+        raise HTTPException(status_code=400, detail=f"Escrow is already {existing.get('status')}")
+    await _invalidate_escrow_lists(doc["payer_email"], [r["email"] for r in doc.get("recipients", [])])
+    return doc
 
-    db["escrow"].update_one({"_id": oid}, {"$set": updates})
 
-    # Determine if releasable (both sides confirmed)
-    doc = db["escrow"].find_one({"_id": oid})
-    all_rec_confirmed = all(r.get("confirmed") for r in doc.get("recipients", []))
-    new_status = "releasable" if (doc.get("payer_confirmed") and all_rec_confirmed) else doc.get("status")
-    if new_status != doc.get("status"):
-        db["escrow"].update_one({"_id": oid}, {"$set": {"status": new_status}})
+async def _release_escrow(oid: ObjectId) -> dict:
+    """Mark a releasable escrow as released and return the updated escrow document."""
+    # This is a stub for on-chain release. In this demo we simply mark as released when releasable.
+    # Guarding on status inside the update makes concurrent releases race-free: only one can match.
+    doc = await db["escrow"].find_one_and_update(
+        {"_id": oid, "status": "releasable"},
+        {"$set": {"status": "released", "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        # Only the miss path pays for a second lookup to tell the errors apart
+        existing = await db["escrow"].find_one({"_id": oid}, {"status": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Escrow not found")
+        if existing.get("status") in ("released", "cancelled"):
+            raise HTTPException(status_code=400, detail=f"Escrow is already {existing.get('status')}")
+        raise HTTPException(status_code=400, detail="Escrow is not yet releasable")
 
-    return {"message": "Confirmation recorded", "status": new_status}
+    await _invalidate_escrow_lists(doc["payer_email"], [r["email"] for r in doc.get("recipients", [])])
+    return doc
 
 
-@app.post("/api/escrows/{escrow_id}/release")
-def release_escrow(escrow_id: str):
-    # This is a stub for on-chain release. In this demo we simply mark as released when releasable.
-    try:
-        oid = ObjectId(escrow_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid escrow id")
+@app.post("/api/escrows/{escrow_id}/confirm")
+async def confirm_escrow(escrow_id: str, payload: ConfirmRequest):
+    # Minimal logical confirmation: set flags when payer and all recipients confirmed
+    doc = await _confirm_escrow(_parse_escrow_id(escrow_id), payload.actor)
+    return {"message": "Confirmation recorded", "status": doc.get("status")}
 
-    doc = db["escrow"].find_one({"_id": oid})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Escrow not found")
-    if doc.get("status") != "releasable":
-        raise HTTPException(status_code=400, detail="Escrow is not yet releasable")
 
-    db["escrow"].update_one({"_id": oid}, {"$set": {"status": "released"}})
-    return {"message": "Funds released (simulated)", "status": "released"}
+@app.post("/api/escrows/{escrow_id}/release")
+async def release_escrow(escrow_id: str):
+    doc = await _release_escrow(_parse_escrow_id(escrow_id))
+    return {"message": "Funds released (simulated)", "status": doc["status"]}
 
 
 # ----- P2P convenience endpoint -----
 class P2PCreateRequest(BaseModel):
     payer_email: EmailStr
     recipient_email: EmailStr
-    amount: float
-    currency: str = "USDC"
-    chain: str = "testnet"
+    amount: float = Field(..., gt=0, allow_inf_nan=False)
+    currency: Currency = "USDC"
+    chain: Chain = "testnet"
     title: Optional[str] = "P2P Payment"
     description: Optional[str] = None
 
 
 @app.post("/api/p2p")
-def create_p2p_escrow(payload: P2PCreateRequest):
-    recipients = [Recipient(email=payload.recipient_email, percentage=100.0)]
-    escrow_doc = Escrow(
-        title=payload.title or "P2P Payment",
-        description=payload.description,
-        payer_email=payload.payer_email,
-        total_amount=payload.amount,
-        currency=payload.currency,
-        chain=payload.chain,
-        recipients=recipients,
-        payer_confirmed=False,
-        status="funded",
-    )
-    inserted_id = create_document("escrow", escrow_doc)
+async def create_p2p_escrow(payload: P2PCreateRequest):
+    escrow_doc = {
+        "title": payload.title or "P2P Payment",
+        "description": payload.description,
+        "payer_email": payload.payer_email,
+        "total_amount": payload.amount,
+        "currency": payload.currency,
+        "chain": payload.chain,
+        "recipients": [{"email": payload.recipient_email, "percentage": 100.0, "wallet": None, "confirmed": False}],
+        "payer_confirmed": False,
+        "status": "funded",
+    }
+    inserted_id = await create_document("escrow", escrow_doc)
+    await _invalidate_escrow_lists(escrow_doc["payer_email"], [payload.recipient_email])
     return {"id": inserted_id, "message": "P2P escrow created"}
 
 
 # ----- Telegram Bot Webhook -----
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}" if TELEGRAM_BOT_TOKEN else None
+tg_client: Optional[httpx.AsyncClient] = None
 
 
-def send_telegram_message(chat_id: int, text: str):
-    if not TELEGRAM_API:
+async def send_telegram_message(chat_id: int, text: str) -> bool:
+    """Send one message; failures are logged and reported by the return value."""
+    if not TELEGRAM_API or tg_client is None:
+        return False
+    try:
+        resp = await tg_client.post(f"{TELEGRAM_API}/sendMessage", json={"chat_id": chat_id, "text": text})
+    except Exception:
+        logger.exception("Failed to send Telegram message to chat %s", chat_id)
+        return False
+    if not resp.is_success:
+        # Logged without the request URL, which embeds the bot token
+        logger.error("Telegram sendMessage to chat %s failed: %s %s", chat_id, resp.status_code, resp.text[:200])
+        return False
+    return True
+
+
+TELEGRAM_MAX_MESSAGES_PER_SECOND = 30  # Telegram's global bot limit
+
+
+async def send_telegram_messages(messages: List[Tuple[int, str]]) -> List[bool]:
+    """Fan out (chat_id, text) messages over the pooled client, at most 30 per second.
+
+    Returns one success flag per message, in input order.
+    """
+    loop = asyncio.get_running_loop()
+    results: List[bool] = []
+    for start in range(0, len(messages), TELEGRAM_MAX_MESSAGES_PER_SECOND):
+        window_start = loop.time()
+        batch = messages[start : start + TELEGRAM_MAX_MESSAGES_PER_SECOND]
+        results.extend(await asyncio.gather(*(send_telegram_message(chat_id, text) for chat_id, text in batch)))
+        if start + TELEGRAM_MAX_MESSAGES_PER_SECOND < len(messages):
+            await asyncio.sleep(max(0.0, 1.0 - (loop.time() - window_start)))
+    failed = results.count(False)
+    if failed:
+        logger.warning("%d of %d Telegram messages failed to send", failed, len(messages))
+    return results
+
+
+# Telegram command handlers. Each receives the already-tokenized message text, the
+# sender's profile and a reply callback.
+async def _handle_start(parts: List[str], profile: dict, reply):
+    reply(
+        "Welcome to SplitPay P2P!\n\nLink your email with /link your@email.com\nCreate a payment: /pay recipient@email.com 25 USDC\nConfirm: /confirm <escrow_id>\nRelease: /release <escrow_id>\nView: /my"
+    )
+
+
+async def _handle_link(parts: List[str], profile: dict, reply):
+    if len(parts) < 2:
+        reply("Usage: /link your@email.com")
+        return
+    email = parts[1]
+    await db["telegramprofile"].update_one(
+        {"chat_id": profile["chat_id"]}, {"$set": {"email": email, "username": profile.get("username")}}
+    )
+    reply(f"Linked email: {email}")
+
+
+async def _handle_pay(parts: List[str], profile: dict, reply):
+    if len(parts) < 3:
+        reply("Usage: /pay recipient@email 25 [USDC]")
         return
+    recipient_email = parts[1]
     try:
-        requests.post(f"{TELEGRAM_API}/sendMessage", json={"chat_id": chat_id, "text": text})
+        amount = float(parts[2])
     except Exception:
-        pass
+        reply("Amount must be a number, e.g., 25")
+        return
+    currency = parts[3] if len(parts) >= 4 else "USDC"
+    payer_email = profile.get("email")
+    if not payer_email:
+        reply("Please link your email first: /link your@email.com")
+        return
+    # Create P2P escrow
+    try:
+        recipients = [Recipient(email=recipient_email, percentage=100.0)]
+        escrow_doc = Escrow(
+            title="P2P Payment",
+            description=f"P2P via Telegram from {payer_email} to {recipient_email}",
+            payer_email=payer_email,
+            total_amount=amount,
+            currency=currency,
+            chain="testnet",
+            recipients=recipients,
+            payer_confirmed=False,
+            status="funded",
+        )
+    except ValidationError as e:
+        reply(f"❌ Invalid payment: {e.errors()[0]['msg']}")
+        return
+    escrow_id = await create_document("escrow", escrow_doc)
+    await _invalidate_escrow_lists(escrow_doc.payer_email, [r.email for r in escrow_doc.recipients])
+    reply(
+        f"✅ Created escrow {escrow_id}\nPayer confirm: /confirm {escrow_id}\nRecipient confirm: recipients can also /confirm {escrow_id} after linking their email with /link"
+    )
+
+
+async def _handle_confirm(parts: List[str], profile: dict, reply):
+    if len(parts) < 2:
+        reply("Usage: /confirm <escrow_id>")
+        return
+    escrow_id = parts[1]
+    actor_email = profile.get("email")
+    if not actor_email:
+        reply("Please link your email first: /link your@email.com")
+        return
+    try:
+        res = await _confirm_escrow(_parse_escrow_id(escrow_id), actor_email)
+        reply(f"✅ Confirmed. Status: {res['status']}")
+    except HTTPException as e:
+        reply(f"❌ {e.detail}")
+
+
+async def _handle_release(parts: List[str], profile: dict, reply):
+    if len(parts) < 2:
+        reply("Usage: /release <escrow_id>")
+        return
+    escrow_id = parts[1]
+    try:
+        res = await _release_escrow(_parse_escrow_id(escrow_id))
+        reply(f"✅ Released. Status: {res['status']}")
+    except HTTPException as e:
+        reply(f"❌ {e.detail}")
+
+
+async def _handle_my(parts: List[str], profile: dict, reply):
+    email = profile.get("email")
+    if not email:
+        reply("Link your email first: /link your@email.com")
+        return
+    # Only the 10 most recent are shown, so let Mongo sort and cut the list
+    items = await _list_escrows(email, limit=10)
+    if not items:
+        reply("No escrows yet.")
+    else:
+        lines = [
+            f"• {i['id']}: {i['status']} {i['currency']} {i['total_amount']} to {[r['email'] for r in i['recipients']]}"
+            for i in items
+        ]
+        reply("Your escrows:\n" + "\n".join(lines))
+
+
+async def _handle_unknown(parts: List[str], profile: dict, reply):
+    reply("Unknown command. Try /start")
+
+
+# /start, /link <email>, /pay <email> <amount> [USDC], /confirm <escrow_id>, /release <escrow_id>, /my
+HANDLERS = {
+    "/start": _handle_start,
+    "/link": _handle_link,
+    "/pay": _handle_pay,
+    "/confirm": _handle_confirm,
+    "/release": _handle_release,
+    "/my": _handle_my,
+}
 
 
 @app.post("/telegram/webhook")
-async def telegram_webhook(request: Request):
+async def telegram_webhook(request: Request, bg: BackgroundTasks):
     if not TELEGRAM_API:
         # Allow graceful testing without token
         return {"ok": True, "message": "Telegram token not configured"}
@@ -230,117 +577,28 @@ async def telegram_webhook(request: Request):
     from_user = message.get("from", {})
     username = from_user.get("username")
 
-    # Ensure a profile exists
-    profile = db["telegramprofile"].find_one({"chat_id": chat_id})
-    if not profile:
-        profile_doc = TelegramProfile(chat_id=chat_id, username=username)
-        _ = create_document("telegramprofile", profile_doc)
-        profile = db["telegramprofile"].find_one({"chat_id": chat_id})
+    # Ensure a profile exists (atomic upsert, backed by the unique chat_id index)
+    now = datetime.now(timezone.utc)
+    profile_doc = TelegramProfile(chat_id=chat_id, username=username).model_dump(exclude={"username"})
+    profile = await db["telegramprofile"].find_one_and_update(
+        {"chat_id": chat_id},
+        {
+            "$setOnInsert": {**profile_doc, "created_at": now, "updated_at": now},
+            "$set": {"username": username},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
 
     def reply(msg: str):
-        send_telegram_message(chat_id, msg)
-
-    # Parse commands: /start, /link <email>, /pay <email> <amount> [USDC], /confirm <escrow_id>, /release <escrow_id>, /my
-    if text.startswith("/start"):
-        reply(
-            "Welcome to SplitPay P2P!\n\nLink your email with /link your@email.com\nCreate a payment: /pay recipient@email.com 25 USDC\nConfirm: /confirm <escrow_id>\nRelease: /release <escrow_id>\nView: /my"
-        )
-        return {"ok": True}
-
-    if text.startswith("/link"):
-        parts = text.split()
-        if len(parts) >= 2:
-            email = parts[1]
-            db["telegramprofile"].update_one({"chat_id": chat_id}, {"$set": {"email": email, "username": username}})
-            reply(f"Linked email: {email}")
-        else:
-            reply("Usage: /link your@email.com")
-        return {"ok": True}
-
-    if text.startswith("/pay"):
-        parts = text.split()
-        if len(parts) >= 3:
-            recipient_email = parts[1]
-            try:
-                amount = float(parts[2])
-            except Exception:
-                reply("Amount must be a number, e.g., 25")
-                return {"ok": True}
-            currency = parts[3] if len(parts) >= 4 else "USDC"
-            payer_email = (profile or {}).get("email")
-            if not payer_email:
-                reply("Please link your email first: /link your@email.com")
-                return {"ok": True}
-            # Create P2P escrow
-            recipients = [Recipient(email=recipient_email, percentage=100.0)]
-            escrow_doc = Escrow(
-                title="P2P Payment",
-                description=f"P2P via Telegram from {payer_email} to {recipient_email}",
-                payer_email=payer_email,
-                total_amount=amount,
-                currency=currency,
-                chain="testnet",
-                recipients=recipients,
-                payer_confirmed=False,
-                status="funded",
-            )
-            escrow_id = create_document("escrow", escrow_doc)
-            reply(
-                f"✅ Created escrow {escrow_id}\nPayer confirm: /confirm {escrow_id}\nRecipient confirm: recipients can also /confirm {escrow_id} after linking their email with /link"
-            )
-        else:
-            reply("Usage: /pay recipient@email 25 [USDC]")
-        return {"ok": True}
-
-    if text.startswith("/confirm"):
-        parts = text.split()
-        if len(parts) >= 2:
-            escrow_id = parts[1]
-            actor_email = (profile or {}).get("email")
-            if not actor_email:
-                reply("Please link your email first: /link your@email.com")
-                return {"ok": True}
-            # call API internally
-            try:
-                res = confirm_escrow(escrow_id, ConfirmRequest(actor=actor_email))
-                reply(f"✅ Confirmed. Status: {res['status']}")
-            except HTTPException as e:
-                reply(f"❌ {e.detail}")
-        else:
-            reply("Usage: /confirm <escrow_id>")
-        return {"ok": True}
-
-    if text.startswith("/release"):
-        parts = text.split()
-        if len(parts) >= 2:
-            escrow_id = parts[1]
-            try:
-                res = release_escrow(escrow_id)
-                reply(f"✅ Released. Status: {res['status']}")
-            except HTTPException as e:
-                reply(f"❌ {e.detail}")
-        else:
-            reply("Usage: /release <escrow_id>")
-        return {"ok": True}
-
-    if text.startswith("/my"):
-        email = (profile or {}).get("email")
-        if not email:
-            reply("Link your email first: /link your@email.com")
-            return {"ok": True}
-        items = list_escrows(email=email)["items"]
-        if not items:
-            reply("No escrows yet.")
-        else:
-            lines = [
-                f"• {i['id']}: {i['status']} {i['currency']} {i['total_amount']} to {[r['email'] for r in i['recipients']]}"
-                for i in items[:10]
-            ]
-            reply("Your escrows:\n" + "\n".join(lines))
-        return {"ok": True}
-
-    # default fallback
-    reply("Unknown command. Try /start")
+        # Sent after the response so Telegram's webhook is ACKed without waiting on the outbound call
+        bg.add_task(send_telegram_message, chat_id, msg)
+
+    parts = text.split()
+    # Group chats address commands as /cmd@BotName
+    cmd = parts[0].split("@", 1)[0] if parts else ""
+    handler = HANDLERS.get(cmd, _handle_unknown)
+    await handler(parts, profile, reply)
     return {"ok": True}
 
 
@@ -348,4 +606,11 @@ if __name__ == "__main__":
     import uvicorn
 
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", 4)),
+    )
@@ -9,9 +9,11 @@ These models are used for validation and for the database viewer.
 """
 from __future__ import annotations
 
-from pydantic import BaseModel, Field, EmailStr, condecimal
+from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Literal
-from decimal import Decimal
+
+Currency = Literal["USD", "USDC", "USDT", "ETH", "BTC"]
+Chain = Literal["ethereum", "polygon", "solana", "bitcoin", "testnet"]
 
 
 class User(BaseModel):
@@ -32,11 +34,9 @@ class Escrow(BaseModel):
     title: str = Field(..., description="Short name for this escrow")
     description: Optional[str] = Field(None, description="What is being paid for")
     payer_email: EmailStr = Field(..., description="Payer's email")
-    total_amount: condecimal(gt=0) = Field(..., description="Total amount to be distributed")
-    currency: Literal["USD", "USDC", "USDT", "ETH", "BTC"] = Field("USDC", description="Currency/asset symbol")
-    chain: Literal["ethereum", "polygon", "solana", "bitcoin", "testnet"] = Field(
-        "testnet", description="Target blockchain network"
-    )
+    total_amount: float = Field(..., gt=0, allow_inf_nan=False, description="Total amount to be distributed")
+    currency: Currency = Field("USDC", description="Currency/asset symbol")
+    chain: Chain = Field("testnet", description="Target blockchain network")
     recipients: List[Recipient] = Field(..., description="Who gets paid and how much")
     payer_confirmed: bool = Field(False, description="Has the payer confirmed?")
     status: Literal["pending", "funded", "releasable", "released", "cancelled"] = Field(